@@ -2,64 +2,362 @@
 remote_agent_client.py
 
 Host-side client for communicating with the remote runner agent.
-Provides simple wrappers: get_status(), get_screenshot(), exec_action()
+Provides simple wrappers: get_status(), get_screenshot(), exec_action(),
+click()/type_text()/scroll() shortcuts, exec_batch()/batch() for sending several
+actions in one request, and poll() which fetches status and screenshot concurrently
 
 Usage (host):
 from external_reused.remote_agent_client import RemoteAgentClient
 client = RemoteAgentClient('http://remote-ip:8000', api_token='your-token')
 print(client.get_status())
-img = client.get_screenshot()
+shot = client.get_screenshot()  # Screenshot: .raw bytes, .image decodes lazily
 resp = client.exec_action({'action': 'click', 'coordinates': [100, 200]})
+client.close()  # or use the client as a context manager
+
+Async usage (requires httpx):
+async with AsyncRemoteAgentClient('http://remote-ip:8000', api_token='your-token') as client:
+    status, img = await asyncio.gather(client.get_status(), client.get_screenshot())
 
 Note: Keep network access restricted. Prefer host-only network or SSH tunnel.
 """
 
 import requests
-import base64
-from PIL import Image
+from requests.adapters import HTTPAdapter
+try:
+    import pybase64 as base64  # SIMD-accelerated, drop-in for the stdlib module
+except ImportError:
+    import base64
+try:
+    from orjson import loads as json_loads, dumps as json_dumps  # Works on bytes directly
+except ImportError:
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+try:
+    from xxhash import xxh3_64_intdigest as frame_digest
+except ImportError:
+    import hashlib
+
+    def frame_digest(data):
+        return hashlib.blake2b(data, digest_size=8).digest()
 import io
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Pre-serialized /exec bodies for the fixed-shape actions; only the varying
+# fields are patched in, skipping dict construction and JSON encoding per event
+_CLICK_TMPL = b'{"action":"click","coordinates":[%d,%d]}'
+_TYPE_TMPL = b'{"action":"type","coordinates":[%d,%d],"text":%s}'
+_SCROLL_TMPL = b'{"action":"scroll","dx":%d,"dy":%d}'
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+_Image = None  # PIL.Image, imported on first decode
+
+
+def _pil_image():
+    # Pillow is only needed to decode screenshots; action-only clients never load it
+    global _Image
+    if _Image is None:
+        from PIL import Image
+        _Image = Image
+    return _Image
+
+
+def _rpc(fn):
+    """Turn transport and decoding errors into the {'error': ...} dicts the
+    client methods return instead of raising."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return fn(self, *args, **kwargs)
+        except self._errors as e:
+            return {'error': type(e).__name__, 'detail': str(e)}
+    return wrapper
+
+
+def _async_rpc(fn):
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await fn(self, *args, **kwargs)
+        except self._errors as e:
+            return {'error': type(e).__name__, 'detail': str(e)}
+    return wrapper
+
+
+class Screenshot:
+    """Compressed screenshot bytes as sent by the agent; decoded to a PIL
+    image only when .image is first accessed."""
+    __slots__ = ('raw', 'mime', '_img')
+
+    def __init__(self, raw: bytes, mime: str = 'image/jpeg'):
+        self.raw = raw
+        self.mime = mime
+        self._img = None
 
-class RemoteAgentClient:
-    def __init__(self, base_url: str, api_token: str = None, timeout: float = 5.0):
+    @property
+    def image(self):
+        if self._img is None:
+            # BytesIO over bytes shares the buffer instead of copying it
+            with io.BytesIO(self.raw) as fp:
+                self._img = _pil_image().open(fp)
+                self._img.load()
+        return self._img
+
+    def thumbnail(self, size):
+        """Decode at roughly `size` (w, h). For JPEG, draft() lets libjpeg decode
+        straight to 1/2, 1/4 or 1/8 scale, skipping most of the full decode."""
+        with io.BytesIO(self.raw) as fp:
+            img = _pil_image().open(fp)
+            img.draft('RGB', size)
+            img.load()
+        if img.width > size[0] or img.height > size[1]:
+            img.thumbnail(size)
+        return img
+
+
+class BatchBuilder:
+    """Collects actions and sends them in a single /exec_batch request on exit.
+
+    with client.batch() as b:          # async client: async with client.batch() as b
+        b.click(100, 200)
+        b.type_text(100, 200, 'hello')
+    print(b.result)
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.actions = []
+        self.result = None
+
+    def click(self, x: int, y: int):
+        self.actions.append({'action': 'click', 'coordinates': [x, y]})
+
+    def type_text(self, x: int, y: int, text: str):
+        self.actions.append({'action': 'type', 'coordinates': [x, y], 'text': text})
+
+    def scroll(self, dy: int, dx: int = 0):
+        self.actions.append({'action': 'scroll', 'dx': dx, 'dy': dy})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.actions:
+            self.result = self._client.exec_batch(self.actions)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None and self.actions:
+            self.result = await self._client.exec_batch(self.actions)
+
+
+class _BaseAgentClient:
+    def __init__(self, base_url: str, api_token: str = None, timeout: float = 5.0,
+                 connect_timeout: float = 0.5, image_format: str = 'webp', max_dim: int = 0):
         self.base_url = base_url.rstrip('/')
         self.api_token = api_token
-        self.timeout = timeout
-        self.last_screenshot = None  # Cache last screenshot for no_change
+        self.timeout = timeout  # Read timeout
+        # Short connect timeout so a dead agent is detected fast on a LAN
+        self.connect_timeout = connect_timeout
+        self.last_screenshot = None  # Cache last Screenshot for no_change / 304
+        self._last_digest = None  # Digest of last_screenshot.raw
+        # Ask for a raw image body (WebP by default, or 'jpeg' for consumers that
+        # want the agent's JPEG as-is) instead of base64 JPEG inside JSON
+        self._screenshot_params = {'format': image_format, 'quality': 70}
+        if max_dim:
+            self._screenshot_params['max_dim'] = max_dim  # Agent downscales before encoding
+        self._screenshot_headers = {'Accept': f'image/{image_format}'}
+        # Headers for the next screenshot request; rebuilt only when a new frame
+        # arrives so the polling loop reuses one dict instead of building it per call
+        self._request_headers = self._screenshot_headers
 
-    def _headers(self):
-        headers = {}
+    def _auth_headers(self):
         if self.api_token:
-            headers['Authorization'] = f'Bearer {self.api_token}'
-        return headers
+            return {'Authorization': f'Bearer {self.api_token}'}
+        return {}
+
+    def _json(self, r):
+        return json_loads(r.content)
+
+    def click(self, x: int, y: int):
+        return self._exec_raw(_CLICK_TMPL % (x, y))
 
+    def type_text(self, x: int, y: int, text: str):
+        return self._exec_raw(_TYPE_TMPL % (x, y, json_dumps(text)))
+
+    def scroll(self, dy: int, dx: int = 0):
+        return self._exec_raw(_SCROLL_TMPL % (dx, dy))
+
+    def exec_batch(self, actions: list):
+        """Run several actions in order with a single round-trip."""
+        return self._exec_raw(json_dumps(actions), '/exec_batch')
+
+    def batch(self):
+        return BatchBuilder(self)
+
+    def _remember_screenshot(self, raw, mime, etag):
+        # Identical bytes (e.g. from agents without ETag support) keep the cached
+        # Screenshot, so an already-decoded image is reused instead of re-decoded
+        digest = frame_digest(raw)
+        if digest != self._last_digest or self.last_screenshot is None:
+            self.last_screenshot = Screenshot(raw, mime)  # Update cache
+            self._last_digest = digest
+        if etag:
+            self._request_headers = {**self._screenshot_headers, 'If-None-Match': etag}
+        else:
+            self._request_headers = self._screenshot_headers
+        return self.last_screenshot
+
+    def _screenshot_from_response(self, r):
+        if r.status_code == 304:
+            return self.last_screenshot  # Not modified, skip body parsing
+        content_type = r.headers.get('Content-Type', '')
+        if content_type.startswith('image/'):
+            return self._remember_screenshot(r.content, content_type, r.headers.get('ETag'))
+        # Older agents ignore the Accept header and still send JSON
+        return self._screenshot_from_json(self._json(r), r.headers.get('ETag'))
+
+    def _screenshot_from_json(self, data, etag=None):
+        if 'no_change' in data and data['no_change']:
+            return self.last_screenshot  # Return cached screenshot
+        if 'image' in data:
+            img_bytes = base64.b64decode(data['image'], validate=False)
+            return self._remember_screenshot(img_bytes, 'image/jpeg', etag)
+        return {'error': 'no image in response'}
+
+
+class RemoteAgentClient(_BaseAgentClient):
+    # ValueError covers malformed JSON and base64 bodies
+    _errors = (requests.RequestException, ValueError)
+
+    def __init__(self, base_url: str, api_token: str = None, timeout: float = 5.0,
+                 connect_timeout: float = 0.5, prefetch: bool = False, image_format: str = 'webp',
+                 max_dim: int = 0):
+        super().__init__(base_url, api_token, timeout, connect_timeout, image_format, max_dim)
+        self._timeout = (connect_timeout, timeout)
+        # Persistent session so keep-alive reuses the socket between calls
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update(self._auth_headers())
+        self._executor = None  # Created on first poll()
+        # With prefetch, the next screenshot is fetched while the caller handles
+        # the current one; get_screenshot then returns a frame up to one call old
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._prefetch_future = None
+
+    def close(self):
+        for executor in (self._executor, self._prefetch_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @_rpc
     def get_status(self):
-        try:
-            r = requests.get(f"{self.base_url}/status", headers=self._headers(), timeout=self.timeout)
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            return {'error': str(e)}
+        r = self._session.get(f"{self.base_url}/status", timeout=self._timeout)
+        r.raise_for_status()
+        return self._json(r)
 
     def get_screenshot(self):
-        try:
-            r = requests.get(f"{self.base_url}/screenshot", headers=self._headers(), timeout=self.timeout)
-            r.raise_for_status()
-            data = r.json()
-            if 'no_change' in data and data['no_change']:
-                return self.last_screenshot  # Return cached image
-            if 'image' in data:
-                img_bytes = base64.b64decode(data['image'])
-                img = Image.open(io.BytesIO(img_bytes))
-                self.last_screenshot = img  # Update cache
-                return img
-            return {'error': 'no image in response'}
-        except Exception as e:
-            return {'error': str(e)}
+        if self._prefetch_executor is None:
+            return self._fetch_screenshot()
+        future = self._prefetch_future
+        result = future.result() if future is not None else self._fetch_screenshot()
+        self._prefetch_future = self._prefetch_executor.submit(self._fetch_screenshot)
+        return result
+
+    @_rpc
+    def _fetch_screenshot(self):
+        r = self._session.get(f"{self.base_url}/screenshot", params=self._screenshot_params,
+                              headers=self._request_headers, timeout=self._timeout)
+        r.raise_for_status()
+        return self._screenshot_from_response(r)
 
+    def poll(self):
+        """Fetch status and screenshot concurrently over the pooled session."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2)
+        status = self._executor.submit(self.get_status)
+        screenshot = self._executor.submit(self.get_screenshot)
+        return {'status': status.result(), 'screenshot': screenshot.result()}
+
+    @_rpc
     def exec_action(self, action: dict):
-        try:
-            r = requests.post(f"{self.base_url}/exec", json=action, headers=self._headers(), timeout=self.timeout)
+        r = self._session.post(f"{self.base_url}/exec", json=action, timeout=self._timeout)
+        r.raise_for_status()
+        return self._json(r)
+
+    @_rpc
+    def _exec_raw(self, body: bytes, path: str = '/exec'):
+        r = self._session.post(f"{self.base_url}{path}", data=body, headers=_JSON_HEADERS, timeout=self._timeout)
+        r.raise_for_status()
+        return self._json(r)
+
+
+class AsyncRemoteAgentClient(_BaseAgentClient):
+    """Async variant of RemoteAgentClient so status, screenshot and exec calls
+    can be awaited concurrently (e.g. with asyncio.gather)."""
+
+    def __init__(self, base_url: str, api_token: str = None, timeout: float = 5.0,
+                 connect_timeout: float = 0.5, image_format: str = 'webp', max_dim: int = 0):
+        super().__init__(base_url, api_token, timeout, connect_timeout, image_format, max_dim)
+        import httpx  # Optional dependency, only needed for the async client
+        self._errors = (httpx.HTTPError, ValueError)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self._auth_headers(),
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    @_async_rpc
+    async def get_status(self):
+        r = await self._client.get('/status')
+        r.raise_for_status()
+        return self._json(r)
+
+    @_async_rpc
+    async def get_screenshot(self):
+        r = await self._client.get('/screenshot', params=self._screenshot_params,
+                                   headers=self._request_headers)
+        if r.is_error:  # httpx's raise_for_status also rejects 304 Not Modified
             r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            return {'error': str(e)}
\ No newline at end of file
+        return self._screenshot_from_response(r)
+
+    async def poll(self):
+        status, screenshot = await asyncio.gather(self.get_status(), self.get_screenshot())
+        return {'status': status, 'screenshot': screenshot}
+
+    @_async_rpc
+    async def exec_action(self, action: dict):
+        r = await self._client.post('/exec', json=action)
+        r.raise_for_status()
+        return self._json(r)
+
+    @_async_rpc
+    async def _exec_raw(self, body: bytes, path: str = '/exec'):
+        r = await self._client.post(path, content=body, headers=_JSON_HEADERS)
+        r.raise_for_status()
+        return self._json(r)
@@ -5,18 +5,36 @@ Simple host agent to run on the Riko host machine. Exposes a minimal HTTP API to
 allow the remote control client to request screenshots and execute actions.
 
 Endpoints:
-- GET /status -> JSON {status: 'ok', hostname, time}
+- GET /status -> JSON {status: 'ok', hostname, local_ip, time}
 - GET /screenshot -> returns base64 JPEG in JSON {image: '<base64>'}
+  (q=70, 4:2:0 chroma, no optimize pass: smaller/faster frames, same legibility)
+  (?format=webp&quality=70 or Accept: image/webp -> raw image/webp body,
+  ?format=jpeg -> raw image/jpeg body;
+  ?quality= also applies to JPEG and to /stream; ?max_dim= caps the longest side)
+  Clients should use the ETag / If-None-Match -> 304 path to skip unchanged frames;
+  {no_change: true} is only sent to JSON requests without If-None-Match and tracks
+  the last frame per connection, so it is unreliable for pooled clients
 - POST /exec -> accept a JSON action (type, params) and execute it; returns success
+- POST /exec_batch -> accept a JSON array of actions and execute them in order
 - POST /update -> force immediate update check; returns status
 
 Security: this is intentionally minimal. Run only on trusted host machines. If you
 expose it beyond localhost you MUST add authentication (not included).
 
 Run on the host with: python host_agent.py --port 8000
+
+Optional speedups (used automatically when installed):
+- PyTurboJPEG + numpy: libjpeg-turbo SIMD JPEG encoding
+- pybase64: SIMD base64 encoding of JSON screenshots
+- orjson: faster JSON encoding/decoding for responses, /exec bodies and the audit log
+- mss: screen capture into a reused per-thread buffer instead of ImageGrab
+- xxhash: fast frame hashing for unchanged-screen detection
+
+On Windows, clicks and typed text go out as one batched SendInput call each,
+falling back to pyautogui elsewhere or if the input is blocked.
 """
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import base64
 import io
@@ -29,174 +47,458 @@ import threading
 import subprocess
 import sys
 import shutil
-from collections import defaultdict
+import queue
+from urllib.parse import urlsplit, parse_qs
+from collections import defaultdict, deque
+try:
+    from orjson import dumps as json_dumps, loads as json_loads  # bytes in, bytes out
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+try:
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(data):
+        return base64.b64encode(data).decode('ascii')
+try:
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except Exception:  # Not installed, or the libjpeg-turbo library is missing
+    _turbojpeg = None
+try:
+    import mss
+except ImportError:
+    mss = None
+try:
+    from xxhash import xxh3_64_intdigest
+except ImportError:
+    xxh3_64_intdigest = hash
+_capture = threading.local()  # mss instances are not thread-safe; one per thread
+
+
+def grab_screen():
+    """Capture the primary screen as an RGB PIL image."""
+    if mss is None:
+        return ImageGrab.grab()
+    sct = getattr(_capture, 'sct', None)
+    if sct is None:
+        sct = _capture.sct = mss.mss()
+    shot = sct.grab(sct.monitors[1])
+    # Single BGRX -> RGB pass straight from the mss buffer
+    return Image.frombuffer('RGB', shot.size, shot.bgra, 'raw', 'BGRX', 0, 1)
+
+
+def release_capture():
+    """Close this thread's mss instance, if any; call before the thread exits."""
+    sct = getattr(_capture, 'sct', None)
+    if sct is not None:
+        _capture.sct = None
+        sct.close()  # Frees the GDI device context and bitmap on Windows
+
+
+GIT = shutil.which('git')  # Looked up once; auto-update is skipped without it
+HOSTNAME = socket.gethostname()  # Resolved once; /status is polled often
+
+MJPEG_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+
+
+def frame_hash(img):
+    """Hash of a frame's pixels, used to detect unchanged screens."""
+    # xxh3 runs at memory speed; SipHash via hash() is over 10x slower on 4K frames
+    return xxh3_64_intdigest(img.tobytes())
+
+
+def downscale(img, max_dim):
+    """Shrink a frame so its longest side is at most max_dim pixels (0 keeps full size)."""
+    if max_dim > 0 and max(img.size) > max_dim:
+        img.thumbnail((max_dim, max_dim), Image.BILINEAR)
+    return img
+
+
+def encode_jpeg(img, quality=70):
+    """Encode a PIL image to JPEG bytes, using libjpeg-turbo when available.
+
+    Screen frames use q=70 with 4:2:0 chroma subsampling and no Huffman
+    optimize pass: text stays legible, frames are ~20% smaller and encode
+    noticeably faster than PIL's defaults.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if _turbojpeg is not None:
+        return _turbojpeg.encode(np.asarray(img), quality=quality, pixel_format=TJPF_RGB,
+                                   jpeg_subsample=TJSAMP_420)
+    buffered = io.BytesIO()
+    img.save(buffered, format='JPEG', quality=quality, subsampling=2,
+             optimize=False, progressive=False)
+    return buffered.getvalue()
+
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _MOUSEINPUT(ctypes.Structure):
+        _fields_ = [('dx', wintypes.LONG), ('dy', wintypes.LONG), ('mouseData', wintypes.DWORD),
+                    ('dwFlags', wintypes.DWORD), ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.c_size_t)]
+
+    class _KEYBDINPUT(ctypes.Structure):
+        _fields_ = [('wVk', wintypes.WORD), ('wScan', wintypes.WORD), ('dwFlags', wintypes.DWORD),
+                    ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.c_size_t)]
+
+    class _INPUTUNION(ctypes.Union):
+        _fields_ = [('mi', _MOUSEINPUT), ('ki', _KEYBDINPUT)]
+
+    class _INPUT(ctypes.Structure):
+        _fields_ = [('type', wintypes.DWORD), ('u', _INPUTUNION)]
+
+    _user32 = ctypes.WinDLL('user32', use_last_error=True)
+    _user32.SendInput.argtypes = (wintypes.UINT, ctypes.POINTER(_INPUT), ctypes.c_int)
+    _user32.SendInput.restype = wintypes.UINT
+    _SPECIAL_KEYS = {'\n': 0x0D, '\r': 0x0D, '\t': 0x09}  # Sent as VK_RETURN / VK_TAB like pyautogui
+
+    def _send_inputs(inputs):
+        n = len(inputs)
+        return _user32.SendInput(n, (_INPUT * n)(*inputs), ctypes.sizeof(_INPUT)) == n
+
+    def send_click(x, y):
+        """Move to (x, y) and left-click in a single SendInput call; False if blocked."""
+        # Absolute coordinates are normalised to 0..65535 over the whole virtual desktop
+        vx, vy = _user32.GetSystemMetrics(76), _user32.GetSystemMetrics(77)
+        vw, vh = _user32.GetSystemMetrics(78), _user32.GetSystemMetrics(79)
+        dx = (x - vx) * 65535 // max(vw - 1, 1)
+        dy = (y - vy) * 65535 // max(vh - 1, 1)
+        move = 0x0001 | 0x8000 | 0x4000  # MOVE | ABSOLUTE | VIRTUALDESK
+        return _send_inputs([
+            _INPUT(0, _INPUTUNION(mi=_MOUSEINPUT(dx, dy, 0, move, 0, 0))),
+            _INPUT(0, _INPUTUNION(mi=_MOUSEINPUT(0, 0, 0, 0x0002, 0, 0))),  # LEFTDOWN
+            _INPUT(0, _INPUTUNION(mi=_MOUSEINPUT(0, 0, 0, 0x0004, 0, 0))),  # LEFTUP
+        ])
+
+    def send_text(text):
+        """Type text with one SendInput call for all key events; False if blocked."""
+        inputs = []
+        for ch in text:
+            vk = _SPECIAL_KEYS.get(ch)
+            if vk is not None:
+                events = [(vk, 0, 0)]
+            else:
+                # KEYEVENTF_UNICODE takes UTF-16 code units, so astral chars are two events
+                data = ch.encode('utf-16-le')
+                events = [(0, int.from_bytes(data[i:i + 2], 'little'), 0x0004)
+                          for i in range(0, len(data), 2)]
+            for vk, scan, flags in events:
+                inputs.append(_INPUT(1, _INPUTUNION(ki=_KEYBDINPUT(vk, scan, flags, 0, 0))))
+                inputs.append(_INPUT(1, _INPUTUNION(ki=_KEYBDINPUT(vk, scan, flags | 0x0002, 0, 0))))  # KEYUP
+        return not inputs or _send_inputs(inputs)
+else:
+    send_click = send_text = None
+
+
+RATE_LIMIT = 10  # Requests per minute per IP
+
 
 class HostAgentHandler(BaseHTTPRequestHandler):
     dry_run = True  # Default to dry-run; set by run_server
-    last_screenshot = None  # Cache last screenshot for delta detection
-    # Simple rate limiting: track requests per IP (max 10 per minute)
-    rate_limit = defaultdict(list)
+    local_ip = 'unknown'  # Resolved once by run_server
+    # Keep-alive: one handler instance serves every request on a connection, so
+    # per-connection state such as last_frame_key survives between polls
+    protocol_version = 'HTTP/1.1'
+    timeout = 30  # Drop idle keep-alive connections so they don't pin a server thread
+    last_frame_key = None  # (kind, hash) of the last JSON frame sent on this connection
+    # Simple rate limiting: track requests per IP (max 10 per minute); the deque
+    # never holds more timestamps than the limit
+    rate_limit = defaultdict(lambda: deque(maxlen=RATE_LIMIT))
+    rate_limit_lock = threading.Lock()  # Requests are served on concurrent threads
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            release_capture()  # One thread per connection; it exits after this
 
-    def _send_json(self, data, status=200):
-        payload = json.dumps(data).encode('utf-8')
+    def _send_json(self, data, status=200, headers=None):
+        payload = json_dumps(data)
+        self._send_bytes(payload, 'application/json', status, headers)
+
+    def _send_bytes(self, data, content_type, status=200, headers=None):
+        if status >= 400:
+            # Error paths may leave a request body unread; don't reuse the connection
+            self.close_connection = True
         self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(payload)
+        self.wfile.write(data)
+
+    def _execute_action(self, pyautogui, payload):
+        action = payload.get('action')  # Looked up once; batches repeat this per action
+        if action == 'click':
+            x, y = payload.get('coordinates', [0, 0])
+            self._click(pyautogui, x, y)
+        elif action == 'type':
+            x, y = payload.get('coordinates', [0, 0])
+            text = payload.get('text', '')
+            self._click(pyautogui, x, y)
+            # One batched SendInput on Windows instead of a keystroke per call
+            if send_text is None or not send_text(text):
+                pyautogui.typewrite(text)
+        elif action == 'scroll':
+            dx = payload.get('dx', 0)
+            dy = payload.get('dy', 0)
+            pyautogui.scroll(dy)  # pyautogui scroll is vertical
+
+    def _click(self, pyautogui, x, y):
+        if send_click is not None:
+            pyautogui.failSafeCheck()  # SendInput bypasses pyautogui's own failsafe
+            if send_click(x, y):
+                return
+        pyautogui.click(x, y)
 
     def _check_rate_limit(self):
         """Simple rate limiting: max 10 requests per minute per IP"""
-        client_ip = self.client_address[0]
         now = time.time()
-        
-        # Clean old entries (older than 1 minute)
-        HostAgentHandler.rate_limit[client_ip] = [
-            ts for ts in HostAgentHandler.rate_limit[client_ip] 
-            if now - ts < 60
-        ]
-        
-        # Check if under limit
-        if len(HostAgentHandler.rate_limit[client_ip]) >= 10:
+        with HostAgentHandler.rate_limit_lock:
+            timestamps = HostAgentHandler.rate_limit[self.client_address[0]]
+
+            # Drop entries older than 1 minute (oldest are on the left)
+            while timestamps and now - timestamps[0] >= 60:
+                timestamps.popleft()
+
+            # Check if under limit
+            limited = len(timestamps) >= RATE_LIMIT
+            if not limited:
+                # Add current request
+                timestamps.append(now)
+        if limited:
             self._send_json({'error': 'rate limit exceeded'}, status=429)
             return False
-            
-        # Add current request
-        HostAgentHandler.rate_limit[client_ip].append(now)
         return True
 
     def do_GET(self):
         if not self._check_rate_limit():
             return
-        if self.path == '/status':
-            info = {
-                'status': 'ok',
-                'hostname': socket.gethostname(),
-                'time': time.time()
-            }
-            self._send_json(info)
+        parts = urlsplit(self.path)
+        handler = self._GET_ROUTES.get(parts.path)
+        if handler is None:
+            self._send_json({'error': 'not found'}, status=404)
             return
+        handler(self, parse_qs(parts.query))
 
-        if self.path == '/screenshot':
-            try:
-                img = ImageGrab.grab()
-                if self.last_screenshot is not None:
-                    # Quick change detection: compare hashes
-                    current_hash = hash(img.tobytes())
-                    last_hash = hash(self.last_screenshot.tobytes())
-                    if current_hash == last_hash:
-                        self._send_json({'no_change': True})
-                        return
-                # Send full image
+    def _handle_status(self, query):
+        info = {
+            'status': 'ok',
+            'hostname': HOSTNAME,
+            'local_ip': self.local_ip,
+            'time': time.time()
+        }
+        self._send_json(info)
+
+    def _handle_screenshot(self, query):
+        # Raw WebP body when negotiated (?format=webp or Accept: image/webp), raw
+        # JPEG body for ?format=jpeg, otherwise base64 JPEG inside JSON for older clients
+        fmt = query.get('format', [''])[0].lower()
+        if not fmt and 'image/webp' in self.headers.get('Accept', ''):
+            fmt = 'webp'
+        try:
+            # ?quality= trades CPU/size for clients on slow links
+            quality = max(1, min(100, int(query.get('quality', ['70'])[0])))
+            max_dim = int(query.get('max_dim', ['0'])[0])
+        except ValueError:
+            self._send_json({'error': 'invalid quality or max_dim'}, status=400)
+            return
+        try:
+            img = grab_screen()
+            current_hash = frame_hash(img)
+            # Conditional GET: unchanged frames cost only a 304 with headers
+            # kind names the representation, so a different format, quality or
+            # size never matches an earlier frame's ETag or no_change key
+            kind = f"{fmt if fmt in ('webp', 'jpeg') else 'json'}-q{quality}"
+            if max_dim > 0:
+                kind += f'@{max_dim}'
+            etag = f'"{kind}-{current_hash & 0xffffffffffffffff:x}"'
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            # Legacy change detection for JSON clients without validators. It is per
+            # connection, so it is only right for a client that polls over a single
+            # connection; a client that sends If-None-Match only ever gets the ETag
+            # answer above, and raw image formats always get an image
+            if (if_none_match is None and kind.startswith('json')
+                    and (kind, current_hash) == self.last_frame_key):
+                self._send_json({'no_change': True})
+                return
+            # Send full image; ?max_dim= downscales 4K captures for thumbnail-sized
+            # viewers, and the hash above is of the full frame, so change detection
+            # is unaffected
+            img = downscale(img, max_dim)
+            if fmt == 'webp':
                 buffered = io.BytesIO()
-                img.save(buffered, format='JPEG')
-                b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                self._send_json({'image': b64})
-                # Update cache
-                self.last_screenshot = img.copy()
-            except Exception as e:
-                self._send_json({'error': str(e)}, status=500)
+                img.save(buffered, format='WEBP', quality=quality)
+                self._send_bytes(buffered.getvalue(), 'image/webp', headers={'ETag': etag})
+            elif fmt == 'jpeg':
+                self._send_bytes(encode_jpeg(img, quality), 'image/jpeg', headers={'ETag': etag})
+            else:
+                b64 = b64encode_as_string(encode_jpeg(img, quality))
+                self._send_json({'image': b64}, headers={'ETag': etag})
+            self.last_frame_key = (kind, current_hash)
+        except Exception as e:
+            self._send_json({'error': str(e)}, status=500)
+
+    def _handle_stream(self, query):
+        # MJPEG streaming; the body has no length, so the connection ends with it
+        self.close_connection = True
+        try:
+            quality = max(1, min(100, int(query.get('quality', ['70'])[0])))
+            max_dim = int(query.get('max_dim', ['0'])[0])
+        except ValueError:
+            self._send_json({'error': 'invalid quality or max_dim'}, status=400)
             return
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.end_headers()
+        # Two-stage pipeline: a capture thread grabs and hashes the next frame
+        # while this thread encodes and sends the previous one
+        stop = threading.Event()
+        slot = queue.Queue(maxsize=1)
 
-        if self.path == '/stream':
-            # MJPEG streaming
-            self.send_response(200)
-            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
-            self.end_headers()
+        def capture_loop():
             try:
-                while True:
-                    img = ImageGrab.grab()
-                    buffered = io.BytesIO()
-                    img.save(buffered, format='JPEG')
-                    frame_data = buffered.getvalue()
-                    self.wfile.write(b'--frame\r\n')
-                    self.wfile.write(b'Content-Type: image/jpeg\r\n')
-                    self.wfile.write(f'Content-Length: {len(frame_data)}\r\n\r\n'.encode())
-                    self.wfile.write(frame_data)
-                    self.wfile.write(b'\r\n')
+                while not stop.is_set():
+                    img = grab_screen()
+                    frame = (img, frame_hash(img))
+                    try:
+                        slot.get_nowait()  # Latest frame wins; drop one the sender hasn't taken
+                    except queue.Empty:
+                        pass
+                    slot.put_nowait(frame)
                     time.sleep(0.1)  # ~10 FPS
-            except Exception:
-                pass  # Client disconnect
-            return
+            finally:
+                release_capture()
+
+        threading.Thread(target=capture_loop, daemon=True).start()
+        last_hash = None
+        last_sent = 0.0
+        write = self.wfile.write  # Bound once for the frame loop
+        try:
+            while True:
+                img, current_hash = slot.get(timeout=5)  # Empty if capture died; ends the stream
+                if current_hash != last_hash:
+                    # Whole multipart part built once per new frame, sent in one write
+                    frame_data = encode_jpeg(downscale(img, max_dim), quality)
+                    part = b''.join((MJPEG_PART_HEADER % len(frame_data), frame_data, b'\r\n'))
+                    last_hash = current_hash
+                elif time.time() - last_sent < 2.0:
+                    # Unchanged screen: skip the frame, re-sending the cached
+                    # JPEG only every 2s as a keepalive
+                    continue
+                write(part)
+                last_sent = time.time()
+        except Exception:
+            pass  # Client disconnect
+        finally:
+            stop.set()
 
-        # Unknown path
-        self._send_json({'error': 'not found'}, status=404)
+    _GET_ROUTES = {
+        '/status': _handle_status,
+        '/screenshot': _handle_screenshot,
+        '/stream': _handle_stream,
+    }
 
     def do_POST(self):
         if not self._check_rate_limit():
             return
-        if self.path == '/update':
-            # Force update endpoint - requires authentication
-            expected_token = os.getenv('REMOTE_API_TOKEN')
-            auth_header = self.headers.get('Authorization', '')
-            if expected_token and not auth_header.startswith(f'Bearer {expected_token}'):
-                self._send_json({'error': 'unauthorized'}, status=401)
-                return
-                
-            print("Force update requested via /update endpoint")
-            try:
-                check_for_updates()
-                self._send_json({'status': 'update_check_completed', 'message': 'Check logs for update status'})
-            except Exception as e:
-                self._send_json({'error': 'update failed'}, status=500)
+        handler = self._POST_ROUTES.get(self.path)
+        if handler is None:
+            self._send_json({'error': 'not found'}, status=404)
             return
+        handler(self)
 
-        if self.path == '/exec':
-            # Check token if configured
-            expected_token = os.getenv('REMOTE_API_TOKEN')
-            auth_header = self.headers.get('Authorization', '')
-            if expected_token and not auth_header.startswith(f'Bearer {expected_token}'):
-                self._send_json({'error': 'unauthorized'}, status=401)
+    def _handle_update(self):
+        # The body is unused, but must be consumed so it isn't parsed as the
+        # next request on this keep-alive connection
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # Force update endpoint - requires authentication
+        expected_token = os.getenv('REMOTE_API_TOKEN')
+        auth_header = self.headers.get('Authorization', '')
+        if expected_token and not auth_header.startswith(f'Bearer {expected_token}'):
+            self._send_json({'error': 'unauthorized'}, status=401)
+            return
+
+        print("Force update requested via /update endpoint")
+        try:
+            check_for_updates()
+            self._send_json({'status': 'update_check_completed', 'message': 'Check logs for update status'})
+        except Exception as e:
+            self._send_json({'error': 'update failed'}, status=500)
+
+    def _handle_exec(self, batch=False):
+        # Check token if configured
+        expected_token = os.getenv('REMOTE_API_TOKEN')
+        auth_header = self.headers.get('Authorization', '')
+        if expected_token and not auth_header.startswith(f'Bearer {expected_token}'):
+            self._send_json({'error': 'unauthorized'}, status=401)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        try:
+            payload = json_loads(body)
+        except Exception:
+            self._send_json({'error': 'invalid json'}, status=400)
+            return
+        # /exec_batch takes a JSON array of actions and runs them in order
+        if batch:
+            if not isinstance(payload, list):
+                self._send_json({'error': 'expected a list of actions'}, status=400)
                 return
+            actions = payload
+        else:
+            actions = [payload]
 
-            length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(length)
+        # Audit log: append-only JSONL with timestamp, origin IP, token-id (masked), full payload
+        client_ip = self.client_address[0]
+        # Mask token for security - only log first 8 chars
+        token_id = (auth_header.split(' ')[-1][:8] + '...') if auth_header else 'none'
+        audit_entry = {
+            'timestamp': time.time(),
+            'client_ip': client_ip,
+            'token_id': token_id,
+            'payload': payload
+        }
+        audit_queue.put(audit_entry)  # Written by audit_writer_loop
+
+        if self.dry_run:
+            self._send_json({'status': 'ok', 'message': 'action logged (dry-run)'} )
+        else:
+            # Execute action (dangerous: only use in isolated environments)
             try:
-                payload = json.loads(body.decode('utf-8'))
-            except Exception:
-                self._send_json({'error': 'invalid json'}, status=400)
-                return
+                import pyautogui
+                for action in actions:
+                    self._execute_action(pyautogui, action)
+                self._send_json({'status': 'ok', 'message': 'action executed (live-run)'})
+            except Exception as e:
+                self._send_json({'error': 'execution failed'}, status=500)
 
-            # Audit log: append-only JSONL with timestamp, origin IP, token-id (masked), full payload
-            client_ip = self.client_address[0]
-            # Mask token for security - only log first 8 chars
-            token_id = (auth_header.split(' ')[-1][:8] + '...') if auth_header else 'none'
-            audit_entry = {
-                'timestamp': time.time(),
-                'client_ip': client_ip,
-                'token_id': token_id,
-                'payload': payload
-            }
-            with open('host_agent_audit.jsonl', 'a', encoding='utf-8') as f:
-                f.write(json.dumps(audit_entry) + '\n')
-
-            if self.dry_run:
-                self._send_json({'status': 'ok', 'message': 'action logged (dry-run)'} )
-            else:
-                # Execute action (dangerous: only use in isolated environments)
-                try:
-                    import pyautogui
-                    if payload.get('action') == 'click':
-                        x, y = payload.get('coordinates', [0, 0])
-                        pyautogui.click(x, y)
-                    elif payload.get('action') == 'type':
-                        x, y = payload.get('coordinates', [0, 0])
-                        text = payload.get('text', '')
-                        pyautogui.click(x, y)
-                        pyautogui.typewrite(text)
-                    elif payload.get('action') == 'scroll':
-                        dx = payload.get('dx', 0)
-                        dy = payload.get('dy', 0)
-                        pyautogui.scroll(dy)  # pyautogui scroll is vertical
-                    self._send_json({'status': 'ok', 'message': 'action executed (live-run)'})
-                except Exception as e:
-                    self._send_json({'error': 'execution failed'}, status=500)
-            return
+    def _handle_exec_batch(self):
+        self._handle_exec(batch=True)
 
-        self._send_json({'error': 'not found'}, status=404)
+    _POST_ROUTES = {
+        '/update': _handle_update,
+        '/exec': _handle_exec,
+        '/exec_batch': _handle_exec_batch,
+    }
 
 
 def check_for_updates():
+    """Update from git and restart if newer code exists; returns False if git failed."""
     repo_url = "https://github.com/Sotired001/Riko-Remote.git"
     if not os.path.exists('.git'):
         print("Not in git repo, cloning repository for auto-update...")
@@ -210,7 +512,6 @@ def check_for_updates():
             
             subprocess.run(['git', 'clone', repo_url, 'temp_repo'], check=True, capture_output=True)
             # Copy updated files
-            import shutil
             for file in ['vm_agent.py', 'install_remote.bat', 'README.txt']:
                 if os.path.exists(f'temp_repo/remote_setup/{file}'):
                     shutil.copy2(f'temp_repo/remote_setup/{file}', file)
@@ -222,10 +523,11 @@ def check_for_updates():
                 print(f"Warning: Could not clean up temp_repo: {e}")
             
             print("Repository cloned and updated successfully, restarting agent...")
+            flush_audit_log()
             os.execv(sys.executable, [sys.executable] + sys.argv)
         except subprocess.CalledProcessError as e:
             print(f"Failed to clone repo: {e}")
-            return
+            return False
     else:
         try:
             # Fetch latest changes
@@ -237,27 +539,82 @@ def check_for_updates():
                 subprocess.run(['git', 'pull'], check=True, capture_output=True)
                 print("Code updated successfully, restarting agent...")
                 # Restart the process to load new code
+                flush_audit_log()
                 os.execv(sys.executable, [sys.executable] + sys.argv)
         except subprocess.CalledProcessError as e:
             print(f"Git command failed: {e}")
+            return False
         except FileNotFoundError:
             print("Git not installed, skipping auto-update")
+            return False
+    return True
+
+
+audit_queue = queue.Queue()
+
+
+def audit_writer_loop():
+    # Single writer keeps the audit file open and flushes whenever the queue
+    # drains, so /exec responses never wait on file I/O
+    with open('host_agent_audit.jsonl', 'ab') as f:
+        while True:
+            entry = audit_queue.get()
+            marker = entry if isinstance(entry, threading.Event) else None
+            try:
+                if marker is None:
+                    f.write(json_dumps(entry) + b'\n')
+                if marker is not None or audit_queue.empty():
+                    f.flush()
+            except Exception as e:
+                # A bad entry or failed write must not kill the writer and let the queue grow
+                print(f"Audit log write failed: {e}")
+            if marker is not None:
+                marker.set()
+
+
+def flush_audit_log(timeout: float = 5.0):
+    """Wait until everything queued so far is written, e.g. before os.execv or exit."""
+    done = threading.Event()
+    audit_queue.put(done)  # FIFO: set by the writer after all earlier entries
+    done.wait(timeout)
 
 
 def check_updates_loop():
+    if GIT is None:
+        print("Git not installed, auto-update disabled")
+        return
     print("Auto-update thread started, checking for updates...")
+    delay = 300  # Check every 5 minutes
     while True:
-        check_for_updates()
-        time.sleep(300)  # Check every 5 minutes
+        try:
+            ok = check_for_updates()
+        except Exception as e:
+            print(f"Update check failed: {e}")
+            ok = False
+        # Back off on failures (e.g. no network for git fetch) instead of retrying at full rate
+        delay = 300 if ok else min(delay * 2, 3600)
+        time.sleep(delay)
 
 
-def run_server(port: int = 8000, host: str = '127.0.0.1', dry_run: bool = False):
+def rate_limit_sweep_loop():
+    # Forget IPs idle for 5 minutes so the rate limit table stays bounded
+    while True:
+        time.sleep(300)
+        now = time.time()
+        with HostAgentHandler.rate_limit_lock:
+            for ip, timestamps in list(HostAgentHandler.rate_limit.items()):
+                if not timestamps or now - timestamps[-1] > 300:
+                    del HostAgentHandler.rate_limit[ip]
+
+
+def run_server(port: int = 8000, host: str = '127.0.0.1', dry_run: bool = False,
+               ready: threading.Event = None):
     HostAgentHandler.dry_run = dry_run
-    server = HTTPServer((host, port), HostAgentHandler)
+    # One thread per connection so a long-running /stream doesn't block other endpoints
+    server = ThreadingHTTPServer((host, port), HostAgentHandler)
     mode = 'dry-run (log only)' if dry_run else 'live-run (executes actions)'
     
     # Get local IP
-    import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(("8.8.8.8", 80))
@@ -266,17 +623,23 @@ def run_server(port: int = 8000, host: str = '127.0.0.1', dry_run: bool = False)
         local_ip = "unknown"
     finally:
         s.close()
-    
+    HostAgentHandler.local_ip = local_ip
+
     print(f"Host agent running on http://{host}:{port} (local IP: {local_ip}) in {mode} mode")
+    threading.Thread(target=audit_writer_loop, daemon=True).start()
     # Start auto-update thread
     update_thread = threading.Thread(target=check_updates_loop, daemon=True)
     update_thread.start()
+    threading.Thread(target=rate_limit_sweep_loop, daemon=True).start()
     print("Auto-update enabled (checks every 5 minutes)")
+    if ready is not None:
+        ready.set()  # Socket is bound and listening; callers can stop waiting
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print('Shutting down')
         server.server_close()
+        flush_audit_log()
 
 
 def main():
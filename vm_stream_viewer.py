@@ -54,23 +54,27 @@ if USE_STREAMING:
         cv2.destroyAllWindows()
 else:
     # Polling mode
-    client = RemoteAgentClient(HOST_AGENT_URL, api_token=REMOTE_API_TOKEN)
+    # Prefetch so the next frame downloads while the current one is displayed;
+    # raw JPEG is encoded by the agent's libjpeg-turbo and decoded by cv2 as-is
+    client = RemoteAgentClient(HOST_AGENT_URL, api_token=REMOTE_API_TOKEN, prefetch=True,
+                               image_format='jpeg')
 
     print(f'Connecting to host agent at {HOST_AGENT_URL} (polling at {POLLING_RATE} FPS)')
 
     try:
         while True:
-            img = client.get_screenshot()
-            if isinstance(img, dict) and 'error' in img:
-                print('Error fetching screenshot:', img)
+            shot = client.get_screenshot()
+            if shot is None or (isinstance(shot, dict) and 'error' in shot):
+                print('Error fetching screenshot:', shot)
                 time.sleep(1)
                 continue
-            # Convert PIL Image to OpenCV BGR
-            frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+            # Decode the compressed bytes straight to OpenCV BGR, no PIL round-trip
+            frame = cv2.imdecode(np.frombuffer(shot.raw, dtype=np.uint8), cv2.IMREAD_COLOR)
             cv2.imshow('Remote Stream', frame)
             key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 break
             time.sleep(poll_delay)
     finally:
+        client.close()
         cv2.destroyAllWindows()